@@ -7,9 +7,24 @@
 """Check code quality using mypy and Ruff."""
 
 import argparse
+import hashlib
+import json
 import logging
+import os
+import shlex
 import subprocess
 import sys
+import tomllib
+from pathlib import Path
+from typing import cast
+
+# dedicated virtual environment for the tools, so that the virtual environment of the checked project is not modified
+VENV_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "check.py" / "venv"
+VENV_BIN = VENV_DIR / "bin"
+TOOLS = ["mypy", "ruff"]
+MAX_CHANGED_FILES = 100
+MYPY_CACHE_DIR = Path(".mypy_cache")
+RUFF_CACHE_DIR = Path(".ruff_cache")
 
 logger = logging.getLogger(__name__)
 
@@ -18,9 +33,21 @@ def main() -> None:
     """Run main function."""
     logging.basicConfig(format="%(levelname)s %(message)s", level=logging.INFO)
     arguments = parse_arguments()
-    run_ruff_check(verbose=arguments.verbose)
-    run_ruff_format(verbose=arguments.verbose)
-    run_mypy(verbose=arguments.verbose)
+    os.environ.setdefault("RUFF_CACHE_DIR", str(RUFF_CACHE_DIR))
+    ensure_tools()
+    ruff_paths = get_ruff_paths()
+    mypy_process = start(get_mypy_command(verbose=arguments.verbose))
+    returncodes = [
+        run(
+            get_ruff_command(ruff_paths, verbose=arguments.verbose),
+            env={**os.environ, "RUFF_NO_CACHE": "false"},
+            program_name="ruff",
+        ),
+        wait(mypy_process),
+    ]
+    returncode = max(returncodes, key=abs)
+    if returncode != 0:
+        sys.exit(returncode)
     logger.info("all checks passed")
 
 
@@ -31,30 +58,98 @@ def parse_arguments() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def run_ruff_format(*, verbose: bool = False) -> None:
-    """Run ruff format."""
-    command = ["uvx", "ruff", "format"]
+def ensure_tools() -> None:
+    """Install tools into a persistent virtual environment to avoid the startup overhead of uvx."""
+    if all((VENV_BIN / tool).exists() for tool in TOOLS):
+        return
+    python = VENV_BIN / "python"
+    if not python.exists() and run(["uv", "venv", "--quiet", str(VENV_DIR)], program_name="uv venv") != 0:
+        logger.warning("could not create %s, falling back to uvx", VENV_DIR)
+        return
+    if run(["uv", "pip", "install", "--quiet", "--python", str(python), *TOOLS], program_name="uv pip") != 0:
+        logger.warning("could not install tools into %s, falling back to uvx", VENV_DIR)
+
+
+def get_tool_command(tool: str) -> list[str]:
+    """Get command prefix for a tool, preferring the persistent virtual environment over uvx."""
+    path = VENV_BIN / tool
+    return [str(path)] if path.exists() else ["uvx", tool]
+
+
+def get_ruff_paths() -> list[str]:
+    """Get paths for Ruff, restricting it to changed files if there are only a few (empty list for all files)."""
+    files = get_changed_python_files()
+    return files if files and len(files) <= MAX_CHANGED_FILES else []
+
+
+def get_changed_python_files() -> list[str] | None:
+    """Get Python files that are modified or untracked in Git (None if Git or the repository is not available)."""
+    files: set[str] = set()
+    for command in (
+        ["git", "diff", "--name-only", "--relative", "-z", "HEAD"],
+        ["git", "ls-files", "--others", "--exclude-standard", "-z"],
+    ):
+        try:
+            process = subprocess.run(command, capture_output=True, check=False, text=True)
+        except OSError:
+            return None
+        if process.returncode != 0:
+            return None
+        files.update(file for file in process.stdout.split("\0") if file)
+    return sorted(file for file in files if file.endswith(".py") and Path(file).exists())
+
+
+def get_ruff_command(paths: list[str], *, verbose: bool = False) -> list[str]:
+    """Get command for running ruff check and ruff format in a single process."""
+    # ruff check --fix and ruff format modify the same files, so they must not run concurrently;
+    # exec replaces the shell with ruff format, as there is nothing left for the shell to do afterwards
+    ruff_check_command = shlex.join(get_ruff_check_command(paths, verbose=verbose))
+    ruff_format_command = shlex.join(get_ruff_format_command(paths, verbose=verbose))
+    return ["sh", "-c", f"{ruff_check_command} && exec {ruff_format_command}"]
+
+
+def get_ruff_format_command(paths: list[str], *, verbose: bool = False) -> list[str]:
+    """Get command for ruff format."""
+    command = [*get_tool_command("ruff"), "format", "--cache-dir", str(RUFF_CACHE_DIR)]
     if not verbose:
         command.append("--quiet")
-    run(command, program_name="ruff format")
+    add_ruff_paths(command, paths)
+    return command
 
 
-def run_mypy(*, verbose: bool = False) -> None:
-    """Run mypy."""
-    command = ["uvx", "mypy", "--strict"]
+def get_mypy_command(*, verbose: bool = False) -> list[str]:
+    """Get command for mypy."""
+    mypy = get_tool_command("mypy")
+    command = [*mypy, "--strict", "--cache-dir", str(get_mypy_cache_dir()), "--sqlite-cache"]
     if verbose:
         command.append("--verbose")
     command.append(".")
-    run(command)
-
-
-def run_ruff_check(*, verbose: bool = False) -> None:
-    """Run ruff check."""
+    return command
+
+
+def get_mypy_cache_dir() -> Path:
+    """Get cache directory for mypy, keyed by mypy version, mypy configuration, and Python version."""
+    # determine the mypy version from its installed metadata, as running mypy --version would delay the checks
+    # (the path also contains the Python version of the virtual environment; empty if uvx is used)
+    mypy_versions = sorted(str(path) for path in VENV_DIR.glob("lib/python*/site-packages/mypy-*.dist-info"))
+    pyproject_path = Path("pyproject.toml")
+    config = (
+        tomllib.loads(pyproject_path.read_text(encoding="utf-8")).get("tool", {}).get("mypy")
+        if pyproject_path.exists()
+        else None
+    )
+    key = json.dumps([mypy_versions, config, list(sys.version_info[:2])], sort_keys=True)
+    return MYPY_CACHE_DIR / hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def get_ruff_check_command(paths: list[str], *, verbose: bool = False) -> list[str]:
+    """Get command for ruff check."""
     command = [
-        "uvx",
-        "ruff",
+        *get_tool_command("ruff"),
         "--quiet",
         "check",
+        "--cache-dir",
+        str(RUFF_CACHE_DIR),
         "--extend-select",
         "ALL",
         "--fix",
@@ -86,29 +181,64 @@ def run_ruff_check(*, verbose: bool = False) -> None:
     ]
     if verbose:
         command.append("--show-files")
-    run(command, program_name="ruff check")
+    add_ruff_paths(command, paths)
+    return command
+
+
+def add_ruff_paths(command: list[str], paths: list[str]) -> None:
+    """Add paths to a Ruff command, making sure that Ruff still excludes paths that are passed explicitly."""
+    if paths:
+        command.extend(["--force-exclude", *paths])
 
 
 def run(
     command: list[str],
     *,
+    env: dict[str, str] | None = None,
+    log: bool = True,
+    program_name: str | None = None,
+) -> int:
+    """Run a command and return its exit code."""
+    return wait(start(command, env=env, log=log, program_name=program_name), program_name=program_name)
+
+
+def start(
+    command: list[str],
+    *,
+    env: dict[str, str] | None = None,
     log: bool = True,
     program_name: str | None = None,
-) -> None:
-    """Run a command and exit if it fails."""
-    if program_name is None:
-        match command[0]:
-            case "uvx":
-                program_name = command[1]
-            case _:
-                program_name = command[0]
+) -> subprocess.Popen[bytes]:
+    """Start a command in the background and capture its output."""
     if log:
-        logger.info("running %s", program_name)
-    try:
-        subprocess.run(command, check=True)
-    except subprocess.CalledProcessError as exception:
-        logger.error("%s failed with exit code %d", program_name, exception.returncode)  # noqa: TRY400
-        sys.exit(exception.returncode)
+        logger.info("running %s", get_program_name(command, program_name=program_name))
+    return subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def wait(process: subprocess.Popen[bytes], *, program_name: str | None = None) -> int:
+    """Wait for a started command, print its output, and return its exit code."""
+    stdout, stderr = process.communicate()
+    sys.stdout.buffer.write(stdout)
+    sys.stdout.flush()
+    sys.stderr.buffer.write(stderr)
+    sys.stderr.flush()
+    if process.returncode != 0:
+        command = cast("list[str]", process.args)
+        logger.error(
+            "%s failed with exit code %d", get_program_name(command, program_name=program_name), process.returncode
+        )
+    return process.returncode
+
+
+def get_program_name(command: list[str], *, program_name: str | None = None) -> str:
+    """Get name of the program run by a command for logging."""
+    if program_name is not None:
+        return program_name
+    match command[0]:
+        case "uvx":
+            return command[1]
+        case _:
+            return Path(command[0]).name
 
 
 if __name__ == "__main__":
@@ -7,20 +7,36 @@
 """Install dotfiles in home directory."""
 
 import argparse
+import contextlib
+import copy
+import functools
+import hashlib
 import json
 import logging
 import os
+import re
 import shutil
+import stat
 import subprocess
 import urllib.request
 from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, cast
+from typing import IO, Any, cast
+
+try:
+    import orjson
+except ImportError:  # orjson is only available after the project dependencies have been installed
+    orjson = None  # type: ignore[assignment, unused-ignore]
 
 START_DELIMITER = "valentjn_dotfiles_start"
 END_DELIMITER = "valentjn_dotfiles_end"
-IGNORE_START_DELIMITER = "valentjn_dotfiles_ignore_start"
-IGNORE_END_DELIMITER = "valentjn_dotfiles_ignore_end"
+IGNORE_START_DELIMITER = b"valentjn_dotfiles_ignore_start"
+IGNORE_END_DELIMITER = b"valentjn_dotfiles_ignore_end"
+ROOT_DIR = Path(__file__).parent
+HOME_DIR = Path.home()
+HASH_DIR = Path(os.environ.get("XDG_CACHE_HOME", HOME_DIR / ".cache")) / "valentjn-dotfiles"
+MAX_WORKERS = 8
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +45,9 @@ def main() -> None:
     """Run main function."""
     logging.basicConfig(format="%(message)s", level=logging.INFO)
     arguments = parse_arguments()
+    read_source_file_and_mode.cache_clear()
+    load_json_source_file.cache_clear()
+    make_dir.cache_clear()
     install_text(".bashrc", dry_run=arguments.dry_run)
     install_text(".gitconfig", dry_run=arguments.dry_run)
     install_text_dir(".local/bin", dry_run=arguments.dry_run, overwrite=True)
@@ -50,58 +69,124 @@ def install_in_workspaces(
     *args: Any,  # noqa: ANN401
     **kwargs: Any,  # noqa: ANN401
 ) -> None:
-    """Install file in all workspaces."""
-    for workspace in sorted(Path("/workspaces").iterdir()):
-        if workspace.name != "dotfiles" and not workspace.name.startswith("."):
-            install(*args, **kwargs, target_dir=workspace)
+    """Install file in all workspaces in parallel."""
+    with os.scandir("/workspaces") as iterator:
+        entries = [entry for entry in iterator if entry.name != "dotfiles" and not entry.name.startswith(".")]
+    workspaces = [Path(entry.path) for entry in sorted(entries, key=lambda entry: entry.name)]
+    if not workspaces:
+        return
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(workspaces))) as executor:
+        list(executor.map(lambda workspace: install(*args, **kwargs, target_dir=workspace), workspaces))
 
 
 def install_json(path: Path | str, *, dry_run: bool = False, target_dir: Path | str | None = None) -> None:
     """Install patch into a JSON file."""
     source, target = get_source_and_target_paths(path, target_dir=target_dir)
-    patch = read_source_file(source)
-    target_str = json.dumps(merge_json(json.loads(patch), json.loads(target.read_text()))) if target.exists() else patch
-    write_file(source, target_str, target, dry_run=dry_run)
+    # skip parsing and merging if the source has not changed and the target has not been modified since
+    hash_path = HASH_DIR / hashlib.sha256(str(target.absolute()).encode()).hexdigest()
+    source_hash = hashlib.sha256(read_source_file(source)).hexdigest()
+    if (
+        target.exists()
+        and hash_path.exists()
+        and hash_path.read_text(encoding="utf-8") == source_hash
+        and target.stat().st_mtime_ns <= hash_path.stat().st_mtime_ns
+    ):
+        logger.info("%s is up to date", target)
+        return
+    target_bytes = (
+        dump_json(merge_json_into(load_json_source_file(source), load_json(target.read_bytes())))
+        if target.exists()
+        else read_source_file(source)
+    )
+    write_file(source, target_bytes, target, dry_run=dry_run)
+    if not dry_run:
+        make_dir(HASH_DIR)
+        hash_path.write_text(source_hash, encoding="utf-8")
+
+
+@functools.cache
+def load_json_source_file(path: Path) -> Any:  # noqa: ANN401
+    """Read and parse a JSON source file only once (the result is shared and must not be modified)."""
+    return load_json(read_source_file(path))
+
+
+def load_json(string: bytes) -> Any:  # noqa: ANN401
+    """Parse UTF-8-encoded JSON, using orjson if available."""
+    return json.loads(string) if orjson is None else orjson.loads(string)
+
+
+def dump_json(value: Any) -> bytes:  # noqa: ANN401
+    """Serialize a value to UTF-8-encoded JSON, using orjson if available."""
+    return (
+        json.dumps(value, ensure_ascii=False, indent=2).encode("utf-8")
+        if orjson is None
+        else orjson.dumps(value, option=orjson.OPT_INDENT_2)
+    )
 
 
 def merge_json[T](source: T, target: T) -> T:
     """Merge two JSON arrays or objects."""
-    if isinstance(source, dict):
-        if not isinstance(target, dict):
-            msg = "cannot merge JSON objects with non-objects"
-            raise TypeError(msg)
-        result = cast("T", source.copy())
-        for key, value in target.items():
-            result[key] = merge_json(source[key], value) if key in source else value  # type: ignore[index]
-        return result
-    if isinstance(source, list):
-        if not isinstance(target, list):
-            msg = "cannot merge JSON arrays with non-arrays"
-            raise TypeError(msg)
+    return merge_json_into(source, copy.deepcopy(target))
+
+
+def merge_json_into[T](source: T, target: T) -> T:
+    """Merge a JSON array or object into another one, modifying the latter in place."""
+    if not isinstance(source, dict | list):
+        return source
+    stack: list[tuple[Any, Any]] = [(source, target)]
+    while stack:
+        source_node, target_node = stack.pop()
+        if isinstance(source_node, dict):
+            if not isinstance(target_node, dict):
+                msg = "cannot merge JSON objects with non-objects"
+                raise TypeError(msg)
+            for key, value in source_node.items():
+                if key in target_node and isinstance(value, dict | list):
+                    stack.append((value, target_node[key]))
+                else:
+                    target_node[key] = value
+        else:
+            if not isinstance(target_node, list):
+                msg = "cannot merge JSON arrays with non-arrays"
+                raise TypeError(msg)
+            target_node[:] = merge_json_arrays(source_node, target_node)
+    return target
+
+
+def merge_json_arrays(source: list[Any], target: list[Any]) -> list[Any]:
+    """Merge two JSON arrays by appending the items of the target that are not in the source."""
+    try:
         source_set = set(source)
-        return cast("T", source + [item for item in target if item not in source_set])
-    return source
+        new_items = [item for item in target if item not in source_set]
+    except TypeError:
+        # objects and arrays are not hashable, so compare their canonical serializations instead
+        source_keys = {json.dumps(item, sort_keys=True) for item in source}
+        new_items = [item for item in target if json.dumps(item, sort_keys=True) not in source_keys]
+    return source + new_items
 
 
 def install_text(
     path: Path | str, *, dry_run: bool = False, overwrite: bool = False, target_dir: Path | str | None = None
 ) -> None:
     """Install patch into a text file (e.g., INI)."""
-    start_delimiter = None if overwrite else f"# {START_DELIMITER}"
-    end_delimiter = None if overwrite else f"# {END_DELIMITER}"
     source, target = get_source_and_target_paths(path, target_dir=target_dir)
-    target_str = target.read_text() if target.exists() else ""
-    target_str = install_string(read_source_file(source), target_str, start_delimiter, end_delimiter)
-    write_file(source, target_str, target, dry_run=dry_run)
+    if overwrite:
+        write_file(source, read_source_file(source), target, dry_run=dry_run)
+        return
+    target_str = target.read_text(encoding="utf-8") if target.exists() else ""
+    patch = read_source_file(source).decode("utf-8")
+    target_str = install_string(patch, target_str, f"# {START_DELIMITER}", f"# {END_DELIMITER}")
+    write_file(source, target_str.encode("utf-8"), target, dry_run=dry_run)
 
 
 def install_text_dir(
     path: Path | str, *, dry_run: bool = False, overwrite: bool = False, target_dir: Path | str | None = None
 ) -> None:
     """Install all text files in a directory."""
-    for file in sorted(Path(path).iterdir()):
-        if file.is_file():
-            install_text(file, dry_run=dry_run, overwrite=overwrite, target_dir=target_dir)
+    with os.scandir(path) as iterator:
+        entries = [entry for entry in iterator if entry.is_file()]
+    for entry in sorted(entries, key=lambda entry: entry.name):
+        install_text(Path(entry.path), dry_run=dry_run, overwrite=overwrite, target_dir=target_dir)
 
 
 def install_string(patch: str, string: str, start_delimiter: str | None, end_delimiter: str | None) -> str:
@@ -109,52 +194,78 @@ def install_string(patch: str, string: str, start_delimiter: str | None, end_del
     if start_delimiter is None or end_delimiter is None:
         return patch
     patch_with_delimiters = f"\n{start_delimiter}\n{patch}\n{end_delimiter}\n"
-    start_index = string.find(start_delimiter)
-    end_index = string.find(end_delimiter, start_index)
-    if start_index == -1 or end_index == -1:
-        return f"{string}{patch_with_delimiters}"
-    return f"{string[: start_index - 1]}{patch_with_delimiters}{string[end_index + len(end_delimiter) + 1 :]}"
+    pattern = rf"\n?{re.escape(start_delimiter)}.*?{re.escape(end_delimiter)}\n?"
+    result, count = re.subn(pattern, lambda _: patch_with_delimiters, string, count=1, flags=re.DOTALL)
+    return result if count > 0 else f"{string}{patch_with_delimiters}"
 
 
 def get_source_and_target_paths(path: Path | str, target_dir: Path | str | None = None) -> tuple[Path, Path]:
     """Get source and target paths for a given file."""
     if target_dir is None:
-        target_dir = Path.home()
-    root = Path(__file__).parent
+        target_dir = HOME_DIR
     path = Path(path)
     if path.is_absolute():
-        path = path.relative_to(root)
-    source = root / path
+        path = path.relative_to(ROOT_DIR)
+    source = ROOT_DIR / path
     target = target_dir / path
     return source, target
 
 
-def read_source_file(path: Path | str) -> str:
+def read_source_file(path: Path | str) -> bytes:
     """Read a source file."""
-    string = Path(path).read_text(encoding="utf-8")
-    lines = []
-    in_ignored_section = False
-    for line in string.splitlines():
-        if IGNORE_START_DELIMITER in line:
-            in_ignored_section = True
-        if not in_ignored_section:
-            lines.append(line)
-        if IGNORE_END_DELIMITER in line:
-            in_ignored_section = False
-    return "\n".join(lines) + "\n"
-
-
-def write_file(source: Path | str, string: str, target: Path | str, *, dry_run: bool = False) -> None:
-    """Write a string to a file."""
+    return read_source_file_and_mode(Path(path))[0]
+
+
+def get_source_file_mode(path: Path | str) -> int:
+    """Get the mode of a source file."""
+    return read_source_file_and_mode(Path(path))[1]
+
+
+@functools.lru_cache(maxsize=256)
+def read_source_file_and_mode(path: Path) -> tuple[bytes, int]:
+    """Read a source file and its mode only once, even if it is installed multiple times."""
+    return strip_ignored_sections(path.read_bytes()), path.stat().st_mode
+
+
+def strip_ignored_sections(content: bytes) -> bytes:
+    """Remove all lines between the ignore delimiters (inclusive)."""
+    parts = []
+    position = 0
+    while (start_index := content.find(IGNORE_START_DELIMITER, position)) != -1:
+        line_start_index = content.rfind(b"\n", position, start_index) + 1 or position
+        parts.append(content[position:line_start_index])
+        end_index = content.find(IGNORE_END_DELIMITER, line_start_index)
+        line_end_index = -1 if end_index == -1 else content.find(b"\n", end_index)
+        position = len(content) if line_end_index == -1 else line_end_index + 1
+    parts.append(content[position:])
+    result = b"".join(parts)
+    return result if result.endswith(b"\n") else result + b"\n"
+
+
+def write_file(source: Path | str, content: bytes, target: Path | str, *, dry_run: bool = False) -> None:
+    """Write bytes to a file."""
     source, target = Path(source), Path(target)
+    if (
+        target.exists()
+        and target.read_bytes() == content
+        and stat.S_IMODE(target.stat().st_mode) == stat.S_IMODE(get_source_file_mode(source))
+    ):
+        logger.info("%s is up to date", target)
+        return
     if dry_run:
         logger.info("would write %s:", target)
-        logger.info(string)
+        logger.info(content.decode("utf-8"))
         return
     logger.info("writing %s", target)
-    target.parent.mkdir(parents=True, exist_ok=True)
-    target.write_text(string, encoding="utf-8")
-    target.chmod(source.stat().st_mode)
+    make_dir(target.parent)
+    target.write_bytes(content)
+    target.chmod(get_source_file_mode(source))
+
+
+@functools.cache
+def make_dir(path: Path) -> None:
+    """Create a directory including its parents only once, even if multiple files are written to it."""
+    path.mkdir(parents=True, exist_ok=True)
 
 
 def install_uv() -> None:
@@ -162,9 +273,18 @@ def install_uv() -> None:
     if shutil.which("uv") is None:
         logger.info("installing uv")
         url = "https://astral.sh/uv/install.sh"
-        with urllib.request.urlopen(url) as response:
-            install_script = response.read().decode("utf-8")
-        subprocess.run(["sh", "-c", install_script], check=True, env={**os.environ, "UV_PRINT_QUIET": "1"})
+        # the response is TLS-encrypted, so its file descriptor cannot be passed to sh directly
+        with (
+            urllib.request.urlopen(url) as response,
+            subprocess.Popen(["sh"], stdin=subprocess.PIPE, env={**os.environ, "UV_PRINT_QUIET": "1"}) as process,
+            # if sh exits early, its exit code is reported below
+            contextlib.suppress(BrokenPipeError),
+        ):
+            stdin = cast("IO[bytes]", process.stdin)
+            shutil.copyfileobj(response, stdin)
+            stdin.close()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, process.args)
 
 
 if __name__ == "__main__":